@@ -1,19 +1,21 @@
-"""List available Gemini models."""
+"""List available Gemini models.
 
-import os
-from dotenv import load_dotenv
-from google import genai
+Run from the repository root with ``python -m backend.list_models``.
+"""
 
-load_dotenv()
+from .services.gemini import client
 
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
 
-print("Available models:")
-try:
-    models = client.models.list()
-    for model in models:
-        if "gemini" in model.name.lower():
-            print(f"  ✓ {model.name}")
-except Exception as e:
-    print(f"Error listing models: {e}")
+def list_gemini_models() -> None:
+    print("Available models:")
+    try:
+        models = client.models.list()
+        for model in models:
+            if "gemini" in model.name.lower():
+                print(f"  ✓ {model.name}")
+    except Exception as e:
+        print(f"Error listing models: {e}")
+
+
+if __name__ == "__main__":
+    list_gemini_models()
@@ -1,27 +1,27 @@
 """Main FastAPI application for Azure PDF Chat."""
 
+import asyncio
 import logging
-import os
 from typing import Optional
 from uuid import uuid4
 
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from dotenv import load_dotenv
-load_dotenv()
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 
 # ------------------ SERVICE IMPORTS ------------------ #
 from .services.cosmos import (
     get_document_text,
     get_history,
+    list_documents as list_user_documents,
     save_document,
-    save_message,
-    USE_LOCAL_MODE,
+    save_messages_bulk,
 )
-from .services.gemini import get_gemini_response
+from .services.gemini import get_gemini_response, index_document
 from .services.pdf import extract_text_from_pdf
-from .services.storage import upload_to_blob
+from .services.storage import close_blob_client, init_blob_client, upload_to_blob
+from .settings import settings
 
 # ------------------ LOGGER SETUP ------------------ #
 logger = logging.getLogger("azure_pdf_chat.backend")
@@ -29,27 +29,17 @@ if not logging.getLogger().handlers:
     logging.basicConfig(level=logging.INFO)
 
 # ------------------ ENV CHECK ------------------ #
-REQUIRED_AZURE_ENV_VARS = [
-    "AZURE_BLOB_CONNECTION_STRING",
-    "AZURE_BLOB_CONTAINER",
-    "COSMOS_URL",
-    "COSMOS_KEY",
-    "COSMOS_DB",
-    "COSMOS_CONTAINER",
-    "ALLOWED_ORIGIN",
-]
-
-_missing_env = [name for name in REQUIRED_AZURE_ENV_VARS if not os.getenv(name)]
+_missing_env = settings.missing_azure_env
 RUN_LOCAL = len(_missing_env) > 0
 
 if RUN_LOCAL:
     logger.warning(
-        "[LOCAL MODE] Azure resources missing: %s. Using local storage + JSON DB.",
+        "[LOCAL MODE] Azure resources missing: %s. Using local storage + SQLite DB.",
         ", ".join(_missing_env),
     )
     allowed_origins = ["http://localhost:5173", "http://localhost:3000"]
 else:
-    allowed_origin_value = os.getenv("ALLOWED_ORIGIN")
+    allowed_origin_value = settings.allowed_origin
     if not allowed_origin_value:
         raise RuntimeError("ALLOWED_ORIGIN must be defined when running in Azure mode.")
     allowed_origins = [allowed_origin_value]
@@ -67,6 +57,22 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# ------------------ LIFECYCLE ------------------ #
+
+@app.on_event("startup")
+async def on_startup() -> None:
+    try:
+        await init_blob_client()
+    except Exception:
+        # Only uploads need Blob Storage; they retry the init on demand.
+        logger.exception("Failed to initialize Azure Blob client.")
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await close_blob_client()
+
+
 # ------------------ MODELS ------------------ #
 
 class UploadResponse(BaseModel):
@@ -76,6 +82,8 @@ class UploadResponse(BaseModel):
 
 
 class AskRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True)
+
     user_id: str
     doc_id: str
     question: str
@@ -102,12 +110,21 @@ async def upload_pdf(user_id: str = Form(...), file: UploadFile = File(...)) ->
     if file.content_type not in {"application/pdf", "application/x-pdf"}:
         raise HTTPException(status_code=400, detail="Only PDF uploads are supported.")
 
+    try:
+        pdf_bytes = await file.read()
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Failed to read PDF upload.") from exc
+
     doc_id = str(uuid4())
 
     try:
-        blob_url, stored_file_name, blob_name = await upload_to_blob(file, doc_id, user_id)
-        document_text = await extract_text_from_pdf(file)
+        # Blob upload (network) and text extraction (worker thread) overlap.
+        (blob_url, stored_file_name, blob_name), document_text = await asyncio.gather(
+            upload_to_blob(pdf_bytes, file.filename or "", file.content_type, doc_id, user_id),
+            extract_text_from_pdf(pdf_bytes),
+        )
         await save_document(doc_id, user_id, stored_file_name, blob_name, blob_url, document_text)
+        await index_document(doc_id, document_text)
     except HTTPException:
         raise
     except Exception as exc:
@@ -133,10 +150,8 @@ async def ask_question(request: AskRequest) -> AskResponse:
         logger.exception("Unable to load document text.")
         raise HTTPException(status_code=500, detail="Failed to load document.") from exc
 
-    await save_message(request.user_id, request.doc_id, "user", question)
-
     try:
-        answer = await get_gemini_response(document_text, question)
+        answer = await get_gemini_response(document_text, question, request.doc_id)
     except RuntimeError as exc:
         # User-friendly error message from gemini.py
         logger.error(f"Gemini API error: {exc}")
@@ -145,17 +160,25 @@ async def ask_question(request: AskRequest) -> AskResponse:
         logger.exception("Gemini generation failed.")
         raise HTTPException(status_code=502, detail="AI service temporarily unavailable. Please try again.") from exc
 
-    await save_message(request.user_id, request.doc_id, "assistant", answer)
+    await save_messages_bulk(
+        request.user_id,
+        request.doc_id,
+        [("user", question), ("assistant", answer)],
+    )
 
     return AskResponse(answer=answer)
 
 
 # ------------------ CHAT HISTORY ------------------ #
 
-@app.get("/api/history")
-async def get_chat_history(user_id: str, doc_id: Optional[str] = None) -> list[dict]:
+# History and document lists are plain dicts already shaped by the storage
+# layer, so they are serialized directly with orjson instead of being
+# re-validated item by item through a response model.
+
+@app.get("/api/history", response_class=ORJSONResponse)
+async def get_chat_history(user_id: str, doc_id: Optional[str] = None) -> ORJSONResponse:
     try:
-        return await get_history(user_id, doc_id)
+        return ORJSONResponse(await get_history(user_id, doc_id))
     except Exception as exc:
         logger.exception("Unable to fetch history.")
         raise HTTPException(status_code=500, detail="Failed to fetch history.") from exc
@@ -163,34 +186,11 @@ async def get_chat_history(user_id: str, doc_id: Optional[str] = None) -> list[d
 
 # ------------------ DOCUMENT LIST ------------------ #
 
-@app.get("/api/documents")
-async def list_documents(user_id: str):
+@app.get("/api/documents", response_class=ORJSONResponse)
+async def list_documents(user_id: str) -> ORJSONResponse:
     """Return list of uploaded documents for the given user."""
-    if USE_LOCAL_MODE:
-        from .services.local_storage import get_history as local_get_history
-
-        documents = await local_get_history(user_id)
-        return [
-            {
-                "id": doc["id"],
-                "file_name": doc.get("file_name", ""),
-                "blob_url": doc.get("blob_url"),
-                "created_at": doc.get("created_at"),
-            }
-            for doc in documents
-        ]
-
-    # Azure Cosmos mode
-    from .services.cosmos import _get_container
-    container = _get_container()
-
-    query = """
-        SELECT c.id, c.file_name, c.blob_url, c.created_at
-        FROM c 
-        WHERE c.type='document' AND c.user_id=@user
-    """
-
-    params = [{"name": "@user", "value": user_id}]
-    docs = list(container.query_items(query=query, parameters=params, enable_cross_partition_query=False))
-
-    return docs
+    try:
+        return ORJSONResponse(await list_user_documents(user_id))
+    except Exception as exc:
+        logger.exception("Unable to list documents.")
+        raise HTTPException(status_code=500, detail="Failed to list documents.") from exc
@@ -3,27 +3,34 @@ Cosmos DB service for Azure PDF Chat.
 Automatically falls back to local storage in development mode.
 """
 
+import asyncio
 import os
 import logging
+import time
+from collections import OrderedDict
+from itertools import groupby
 from datetime import datetime, timezone
 from typing import Optional
 
 from azure.cosmos import CosmosClient, exceptions
+
+from ..settings import settings
 from .local_storage import (
     save_document as local_save_document,
     save_pdf as local_save_pdf,
     get_document_text as local_get_document_text,
     save_message as local_save_message,
+    save_messages as local_save_messages,
     get_history as local_get_history,
 )
 
 logger = logging.getLogger(__name__)
 
-# Required environment variables
-COSMOS_URL = os.getenv("COSMOS_URL")
-COSMOS_KEY = os.getenv("COSMOS_KEY")
-COSMOS_DB = os.getenv("COSMOS_DB")
-COSMOS_CONTAINER = os.getenv("COSMOS_CONTAINER")
+# Required settings
+COSMOS_URL = settings.cosmos_url
+COSMOS_KEY = settings.cosmos_key
+COSMOS_DB = settings.cosmos_db
+COSMOS_CONTAINER = settings.cosmos_container
 
 # Detect local mode if missing env vars
 USE_LOCAL_MODE = not all([COSMOS_URL, COSMOS_KEY, COSMOS_DB, COSMOS_CONTAINER])
@@ -44,17 +51,30 @@ if not USE_LOCAL_MODE:
         USE_LOCAL_MODE = True
 
 
+# In-process cache of document text keyed by (user_id, doc_id).
+_DOC_TEXT_CACHE_SIZE = 256
+_DOC_TEXT_CACHE_TTL = 600.0  # seconds
+
+_doc_text_cache: "OrderedDict[tuple[str, str], tuple[str, float]]" = OrderedDict()
+# One in-flight fetch per key: concurrent misses on the same document share
+# it, while misses on different documents proceed in parallel.
+_doc_text_inflight: "dict[tuple[str, str], asyncio.Task]" = {}
+
+
 def _utc_now() -> str:
     """Return a UTC timestamp in ISO-8601 format without microseconds."""
+    t = time.gmtime()
     return (
-        datetime.now(timezone.utc)
-        .replace(microsecond=0)
-        .isoformat()
-        .replace("+00:00", "Z")
+        f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+        f"T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
     )
 
 
 def _normalize_timestamp(value) -> str:
+    # Already in the canonical "YYYY-MM-DDTHH:MM:SSZ" form written by _utc_now.
+    if isinstance(value, str) and len(value) == 20 and value.endswith("Z"):
+        return value
+
     if value in (None, ""):
         return _utc_now()
 
@@ -81,11 +101,11 @@ def _normalize_timestamp(value) -> str:
             return _utc_now()
 
 
-def _get_container():
-    """Internal helper to get the Cosmos container."""
-    if USE_LOCAL_MODE:
-        raise RuntimeError("Cosmos not available in local mode.")
-    return container
+async def _query(query: str, params: list[dict], **kwargs) -> list[dict]:
+    """Run a Cosmos query in a worker thread and materialize the results."""
+    return await asyncio.to_thread(
+        lambda: list(container.query_items(query=query, parameters=params, **kwargs))
+    )
 
 
 # --------------------------------------------------------------
@@ -118,45 +138,88 @@ async def save_document(
     }
 
     try:
-        container.create_item(item)
+        await asyncio.to_thread(container.create_item, item)
     except Exception as exc:
         logger.exception("Failed to save document in Cosmos DB.")
         raise
 
 
 async def get_document_text(user_id: str, doc_id: str) -> str:
-    """Retrieve extracted text of the stored PDF."""
+    """Retrieve extracted text of the stored PDF.
+
+    Documents are immutable once uploaded, so the text is kept in a small
+    in-process LRU for follow-up questions on the same document.
+    """
+    key = (user_id, doc_id)
+    cached = _cached_document_text(key)
+    if cached is not None:
+        return cached
+
+    # No lock needed: the dict is only touched between awaits on the loop.
+    task = _doc_text_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_load_document_text(key))
+        _doc_text_inflight[key] = task
+        task.add_done_callback(lambda _: _doc_text_inflight.pop(key, None))
+
+    # Shielded so one cancelled request does not cancel the shared fetch.
+    return await asyncio.shield(task)
+
+
+async def _load_document_text(key: tuple[str, str]) -> str:
+    text = await _fetch_document_text(*key)
+    _doc_text_cache[key] = (text, time.monotonic())
+    while len(_doc_text_cache) > _DOC_TEXT_CACHE_SIZE:
+        _doc_text_cache.popitem(last=False)
+    return text
+
+
+def _cached_document_text(key: tuple[str, str]) -> Optional[str]:
+    entry = _doc_text_cache.get(key)
+    if entry is None:
+        return None
+
+    text, stored_at = entry
+    if time.monotonic() - stored_at >= _DOC_TEXT_CACHE_TTL:
+        _doc_text_cache.pop(key, None)
+        return None
+
+    _doc_text_cache.move_to_end(key)
+    return text
+
+
+async def _fetch_document_text(user_id: str, doc_id: str) -> str:
+    """Read extracted text of the stored PDF from the backing store."""
 
     if USE_LOCAL_MODE:
         return await local_get_document_text(user_id, doc_id)
 
     try:
-        query = (
-            "SELECT * FROM c WHERE c.id=@id AND c.user_id=@user AND c.type='document'"
+        # Point read on the /user_id partition: cheaper than a query.
+        item = await asyncio.to_thread(
+            container.read_item, item=doc_id, partition_key=user_id
         )
-        params = [{"name": "@id", "value": doc_id}, {"name": "@user", "value": user_id}]
-        results = list(container.query_items(query=query, parameters=params))
-
-        if not results:
-            raise ValueError("Document not found.")
-        return results[0]["document_text"]
-
-    except Exception as exc:
+    except exceptions.CosmosResourceNotFoundError as exc:
+        raise ValueError("Document not found.") from exc
+    except Exception:
         logger.exception("Error fetching document text from Cosmos.")
         raise
 
+    if item.get("type") != "document":
+        raise ValueError("Document not found.")
+    return item["document_text"]
+
 
 # --------------------------------------------------------------
 # CHAT HISTORY FUNCTIONS
 # --------------------------------------------------------------
 
-async def save_message(user_id: str, doc_id: str, role: str, message: str):
-    """Store each chat message."""
-
-    if USE_LOCAL_MODE:
-        return await local_save_message(user_id, doc_id, role, message)
-
-    item = {
+def _message_item(
+    user_id: str, doc_id: str, role: str, message: str, timestamp: str, seq: int
+) -> dict:
+    # ``seq`` orders messages that share a one-second timestamp, e.g. a
+    # question and its answer written in the same batch.
+    return {
         "id": f"{doc_id}-{role}-{os.urandom(4).hex()}",
         "user_id": user_id,
         "doc_id": doc_id,
@@ -164,16 +227,62 @@ async def save_message(user_id: str, doc_id: str, role: str, message: str):
         "role": role,
         "content": message,
         "message": message,
-        "timestamp": _utc_now(),
+        "timestamp": timestamp,
+        "seq": seq,
     }
 
+
+async def save_message(user_id: str, doc_id: str, role: str, message: str):
+    """Store each chat message."""
+
+    if USE_LOCAL_MODE:
+        return await local_save_message(user_id, doc_id, role, message)
+
+    item = _message_item(user_id, doc_id, role, message, _utc_now(), time.time_ns())
+
     try:
-        container.create_item(item)
+        await asyncio.to_thread(container.create_item, item)
     except Exception:
         logger.exception("Failed to save message in Cosmos DB.")
         raise
 
 
+async def save_messages_bulk(
+    user_id: str, doc_id: str, messages: list[tuple[str, str]]
+):
+    """Store several chat messages for one user in a single round trip.
+
+    All items share the ``user_id`` partition key, so they can be written as
+    one transactional batch. SDKs without batch support fall back to
+    parallel ``create_item`` calls.
+    """
+
+    if USE_LOCAL_MODE:
+        return await local_save_messages(user_id, doc_id, messages)
+
+    timestamp = _utc_now()
+    base_seq = time.time_ns()
+    items = [
+        _message_item(user_id, doc_id, role, message, timestamp, base_seq + index)
+        for index, (role, message) in enumerate(messages)
+    ]
+
+    try:
+        if hasattr(container, "execute_item_batch"):
+            await asyncio.to_thread(
+                container.execute_item_batch,
+                batch_operations=[("create", (item,)) for item in items],
+                partition_key=user_id,
+            )
+        else:
+            await asyncio.gather(
+                *(asyncio.to_thread(container.create_item, item) for item in items)
+            )
+    except Exception:
+        logger.exception("Failed to save messages in Cosmos DB.")
+        raise
+
+
 async def get_history(user_id: str, doc_id: Optional[str] = None):
     """Load conversation for a user or document."""
     if USE_LOCAL_MODE:
@@ -181,9 +290,14 @@ async def get_history(user_id: str, doc_id: Optional[str] = None):
 
     try:
         if doc_id:
+            # Sorted server-side; relies on the composite index
+            # (/user_id ASC, /doc_id ASC, /timestamp ASC) on the container.
+            # Same-second ties are broken by seq below.
             query = (
-                "SELECT * FROM c "
-                "WHERE c.user_id=@user AND c.doc_id=@doc AND c.type='message'"
+                "SELECT c.id, c.type, c.user_id, c.doc_id, c.role, c.content, "
+                "c.message, c.timestamp, c.seq FROM c "
+                "WHERE c.user_id=@user AND c.doc_id=@doc AND c.type='message' "
+                "ORDER BY c.timestamp ASC"
             )
             params = [
                 {"name": "@user", "value": user_id},
@@ -192,16 +306,24 @@ async def get_history(user_id: str, doc_id: Optional[str] = None):
         else:
             # list documents for user
             query = (
-                "SELECT * FROM c "
+                "SELECT c.id, c.type, c.user_id, c.file_name, c.blob_name, "
+                "c.blob_url, c.created_at FROM c "
                 "WHERE c.user_id=@user AND c.type='document'"
             )
             params = [{"name": "@user", "value": user_id}]
 
-        results = list(container.query_items(query=query, parameters=params))
+        results = await _query(query, params)
 
         if doc_id:
+            # Messages written before seq existed sort first within their
+            # second, in the order Cosmos returned them.
+            ordered = [
+                item
+                for _, tied in groupby(results, key=lambda item: item.get("timestamp"))
+                for item in sorted(tied, key=lambda item: item.get("seq", 0))
+            ]
             shaped = []
-            for item in results:
+            for item in ordered:
                 shaped.append(
                     {
                         "id": item.get("id"),
@@ -214,7 +336,6 @@ async def get_history(user_id: str, doc_id: Optional[str] = None):
                     }
                 )
 
-            shaped.sort(key=lambda entry: entry["timestamp"])
             return shaped
 
         documents = []
@@ -236,3 +357,31 @@ async def get_history(user_id: str, doc_id: Optional[str] = None):
     except Exception:
         logger.exception("Failed to load Cosmos history.")
         raise
+
+
+async def list_documents(user_id: str):
+    """Return the document library for a user."""
+    if USE_LOCAL_MODE:
+        documents = await local_get_history(user_id)
+        return [
+            {
+                "id": doc["id"],
+                "file_name": doc.get("file_name", ""),
+                "blob_url": doc.get("blob_url"),
+                "created_at": doc.get("created_at"),
+            }
+            for doc in documents
+        ]
+
+    query = """
+        SELECT c.id, c.file_name, c.blob_url, c.created_at
+        FROM c 
+        WHERE c.type='document' AND c.user_id=@user
+    """
+    params = [{"name": "@user", "value": user_id}]
+
+    try:
+        return await _query(query, params, enable_cross_partition_query=False)
+    except Exception:
+        logger.exception("Failed to list Cosmos documents.")
+        raise
@@ -2,30 +2,63 @@
 
 import asyncio
 import logging
-import os
 import time
-from typing import Final
+from collections import OrderedDict
+from typing import Final, Optional
 
+import numpy as np
 from google import genai
-from dotenv import load_dotenv
+from google.genai import errors, types
 
-# Load environment variables
-load_dotenv()
+from ..settings import settings
 
 logger = logging.getLogger(__name__)
 
-# Rate limiting: track last request time
-_last_request_time = 0.0
-_min_request_interval = 2.0  # Minimum 2 seconds between requests
-
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_API_KEY = settings.gemini_api_key
 if not GEMINI_API_KEY:
     raise RuntimeError("GEMINI_API_KEY is missing. Check your .env file!")
 
-MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+MODEL_NAME = settings.gemini_model
+EMBEDDING_MODEL = settings.gemini_embedding_model
+
+# Documents up to this size are sent whole; longer ones use retrieval.
+MAX_DOCUMENT_CHARS = 12000
 
 client = genai.Client(api_key=GEMINI_API_KEY)
 
+# Rate limiting: a token bucket refilled at MAX_RPM requests per minute, plus
+# a cap on in-flight calls so bursts queue here instead of failing with 429.
+MAX_RPM = settings.gemini_max_rpm
+MAX_CONCURRENT = settings.gemini_max_concurrent
+
+_bucket_lock = asyncio.Lock()
+_tokens = float(MAX_RPM)
+_last_refill = time.monotonic()
+_inflight = asyncio.Semaphore(MAX_CONCURRENT)
+
+
+def _refill_tokens() -> None:
+    global _tokens, _last_refill
+    now = time.monotonic()
+    _tokens = min(float(MAX_RPM), _tokens + (now - _last_refill) * MAX_RPM / 60.0)
+    _last_refill = now
+
+
+async def _acquire_token() -> None:
+    """Wait until the bucket has a token, then take it.
+
+    The lock is held while sleeping so waiters are served in arrival order.
+    """
+    global _tokens
+    async with _bucket_lock:
+        _refill_tokens()
+        if _tokens < 1.0:
+            wait_time = (1.0 - _tokens) * 60.0 / MAX_RPM
+            logger.info(f"Rate limiting: waiting {wait_time:.1f}s before next request")
+            await asyncio.sleep(wait_time)
+            _refill_tokens()
+        _tokens -= 1.0
+
 SYSTEM_PROMPT: Final = (
     "You are an assistant that answers questions strictly using the "
     "provided document text. If the answer cannot be found, reply with "
@@ -33,39 +66,307 @@ SYSTEM_PROMPT: Final = (
 )
 
 
-def _truncate(text: str, max_chars: int = 12000) -> str:
+# Answer cache: exact (doc_id, normalized question) hits first, then a
+# cosine-similarity lookup over embeddings of recent questions for that doc.
+_CACHE_MAX_ENTRIES = 256
+_SIMILARITY_THRESHOLD = 0.92
+
+_exact_cache: "OrderedDict[tuple[str, str], str]" = OrderedDict()
+_embedding_cache: list[tuple[str, np.ndarray, str, str]] = []
+
+
+def _normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _embed(text: str) -> Optional[np.ndarray]:
+    """Return a unit-length FP32 embedding for ``text``, or None on failure."""
+    try:
+        resp = client.models.embed_content(model=EMBEDDING_MODEL, contents=text)
+        vec = np.asarray(resp.embeddings[0].values, dtype=np.float32)
+    except Exception:
+        logger.warning("Embedding request failed; skipping semantic cache.", exc_info=True)
+        return None
+
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        return None
+    return vec / norm
+
+
+def _cache_lookup_exact(doc_id: str, normalized: str) -> Optional[str]:
+    key = (doc_id, normalized)
+    answer = _exact_cache.get(key)
+    if answer is not None:
+        _exact_cache.move_to_end(key)
+    return answer
+
+
+def _cache_lookup_similar(doc_id: str, vec: np.ndarray) -> Optional[str]:
+    candidates = [entry for entry in _embedding_cache if entry[0] == doc_id]
+    if not candidates:
+        return None
+
+    # Vectors are stored normalized, so the dot product is the cosine similarity.
+    scores = np.stack([entry[1] for entry in candidates]) @ vec
+    best = int(np.argmax(scores))
+    if scores[best] < _SIMILARITY_THRESHOLD:
+        return None
+
+    logger.info(
+        "Semantic cache hit (%.3f) for doc %s: %r", scores[best], doc_id, candidates[best][2]
+    )
+    return candidates[best][3]
+
+
+def _cache_store(
+    doc_id: str, normalized: str, vec: Optional[np.ndarray], answer: str
+) -> None:
+    _exact_cache[(doc_id, normalized)] = answer
+    _exact_cache.move_to_end((doc_id, normalized))
+    while len(_exact_cache) > _CACHE_MAX_ENTRIES:
+        _exact_cache.popitem(last=False)
+
+    if vec is not None:
+        _embedding_cache.append((doc_id, vec, normalized, answer))
+        del _embedding_cache[:-_CACHE_MAX_ENTRIES]
+
+
+def _truncate(text: str, max_chars: int = MAX_DOCUMENT_CHARS) -> str:
     if len(text) <= max_chars:
         return text
     return text[:max_chars] + "...\n[Truncated for length]"
 
 
-async def get_gemini_response(document_text: str, question: str) -> str:
-    global _last_request_time
-    
+# Retrieval index for documents longer than MAX_DOCUMENT_CHARS: overlapping
+# chunks plus a row-normalized embedding matrix, keyed by doc_id.
+_CHUNK_SIZE = 1000
+_CHUNK_OVERLAP = 200
+_TOP_K_CHUNKS = 5
+_EMBED_BATCH_SIZE = 100
+_CHUNK_INDEX_MAX_DOCS = 32
+_CHUNK_INDEX_RETRY_AFTER = 60  # seconds before re-embedding after a failed build
+
+# Only touched on the event loop. One build per doc_id is in flight at a time,
+# and a failed build is remembered briefly so questions fall back to
+# truncation instead of each re-embedding the whole document.
+_chunk_index: "OrderedDict[str, tuple[list[str], np.ndarray]]" = OrderedDict()
+_chunk_index_pending: dict[str, asyncio.Task] = {}
+_chunk_index_failed: dict[str, float] = {}
+
+
+def _split_chunks(text: str) -> list[str]:
+    step = _CHUNK_SIZE - _CHUNK_OVERLAP
+    last_start = max(len(text) - _CHUNK_OVERLAP, 1)
+    chunks = [text[start:start + _CHUNK_SIZE] for start in range(0, last_start, step)]
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _build_chunk_index(document_text: str) -> Optional[tuple[list[str], np.ndarray]]:
+    chunks = _split_chunks(document_text)
+    if not chunks:
+        return None
+
+    vectors: list[list[float]] = []
+    try:
+        for start in range(0, len(chunks), _EMBED_BATCH_SIZE):
+            resp = client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=chunks[start:start + _EMBED_BATCH_SIZE],
+            )
+            vectors.extend(embedding.values for embedding in resp.embeddings)
+    except Exception:
+        logger.warning("Failed to embed document chunks; falling back to truncation.", exc_info=True)
+        return None
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return chunks, matrix / norms
+
+
+async def index_document(doc_id: str, document_text: str) -> None:
+    """Chunk and embed a long document so questions can retrieve excerpts.
+
+    Documents that fit in MAX_DOCUMENT_CHARS are sent whole and need no index.
+    """
+    if len(document_text) <= MAX_DOCUMENT_CHARS:
+        return
+    if doc_id in _chunk_index:
+        _chunk_index.move_to_end(doc_id)
+        return
+    if _chunk_index_failed.get(doc_id, 0.0) > time.monotonic():
+        return
+
+    task = _chunk_index_pending.get(doc_id)
+    if task is None:
+        task = asyncio.create_task(_store_chunk_index(doc_id, document_text))
+        _chunk_index_pending[doc_id] = task
+        task.add_done_callback(lambda _: _chunk_index_pending.pop(doc_id, None))
+    await asyncio.shield(task)
+
+
+async def _store_chunk_index(doc_id: str, document_text: str) -> None:
+    index = await asyncio.to_thread(_build_chunk_index, document_text)
+    now = time.monotonic()
+    if index is None:
+        for key in [key for key, expires in _chunk_index_failed.items() if expires <= now]:
+            del _chunk_index_failed[key]
+        _chunk_index_failed[doc_id] = now + _CHUNK_INDEX_RETRY_AFTER
+        return
+
+    _chunk_index_failed.pop(doc_id, None)
+    _chunk_index[doc_id] = index
+    while len(_chunk_index) > _CHUNK_INDEX_MAX_DOCS:
+        _chunk_index.popitem(last=False)
+
+
+def _retrieve_chunks(doc_id: str, question_vec: np.ndarray) -> Optional[str]:
+    index = _chunk_index.get(doc_id)
+    if index is None:
+        return None
+
+    chunks, matrix = index
+    scores = matrix @ question_vec
+    top = np.argsort(scores)[::-1][:_TOP_K_CHUNKS]
+    # Keep excerpts in document order so the model reads them in context.
+    return "\n...\n".join(chunks[i] for i in sorted(top.tolist()))
+
+
+# Gemini context caches holding SYSTEM_PROMPT + document text, keyed by doc_id.
+# A None name records that caching is unavailable for the doc: for the cache
+# lifetime if the API rejected it (e.g. unsupported model), briefly if the
+# failure looked transient (429/5xx/network), so creation is retried soon.
+_CONTEXT_CACHE_TTL = 3600  # seconds
+_CONTEXT_CACHE_MARGIN = 60  # stop using a cache this long before it expires
+_CONTEXT_CACHE_RETRY_AFTER = 60  # seconds
+# Gemini rejects caches below a model-specific token minimum; documents
+# estimated (at ~4 chars per token) to fall short skip creation entirely.
+CONTEXT_CACHE_MIN_TOKENS = settings.gemini_context_cache_min_tokens
+_CHARS_PER_TOKEN = 4
+
+# Both tables are only touched on the event loop; at most one creation per
+# doc_id is in flight, so concurrent first questions share one cache.
+_context_cache_ids: dict[str, tuple[Optional[str], float]] = {}
+_context_cache_pending: dict[str, asyncio.Task] = {}
+
+
+def _create_context_cache(document_text: str) -> str:
+    cache = client.caches.create(
+        model=MODEL_NAME,
+        config=types.CreateCachedContentConfig(
+            system_instruction=SYSTEM_PROMPT,
+            contents=[f"Document Text:\n{_truncate(document_text)}"],
+            ttl=f"{_CONTEXT_CACHE_TTL}s",
+        ),
+    )
+    return cache.name
+
+
+async def _build_context_cache(doc_id: str, document_text: str) -> Optional[str]:
+    ttl = _CONTEXT_CACHE_TTL - _CONTEXT_CACHE_MARGIN
+    try:
+        # Creation is a Gemini call of its own, so it takes its own rate-limit token.
+        async with _inflight:
+            await _acquire_token()
+            name = await asyncio.to_thread(_create_context_cache, document_text)
+    except errors.ClientError as exc:
+        name = None
+        if exc.code == 429:
+            ttl = _CONTEXT_CACHE_RETRY_AFTER
+            logger.info("Context cache creation rate-limited for doc %s; sending text inline.", doc_id)
+        else:
+            logger.info("Context caching unavailable for doc %s; sending text inline.", doc_id)
+    except Exception:
+        logger.warning(
+            "Context cache creation failed for doc %s; retrying in %ss.",
+            doc_id,
+            _CONTEXT_CACHE_RETRY_AFTER,
+            exc_info=True,
+        )
+        name = None
+        ttl = _CONTEXT_CACHE_RETRY_AFTER
+
+    _context_cache_ids[doc_id] = (name, time.monotonic() + ttl)
+    return name
+
+
+async def _context_cache_name(doc_id: str, document_text: str) -> Optional[str]:
+    """Return the context cache for ``doc_id``, creating it on first use."""
+    cached_chars = len(SYSTEM_PROMPT) + min(len(document_text), MAX_DOCUMENT_CHARS)
+    if cached_chars < CONTEXT_CACHE_MIN_TOKENS * _CHARS_PER_TOKEN:
+        return None
+
+    now = time.monotonic()
+    entry = _context_cache_ids.get(doc_id)
+    if entry and entry[1] > now:
+        return entry[0]
+
+    for key in [key for key, (_, expires) in _context_cache_ids.items() if expires <= now]:
+        del _context_cache_ids[key]
+
+    task = _context_cache_pending.get(doc_id)
+    if task is None:
+        task = asyncio.create_task(_build_context_cache(doc_id, document_text))
+        _context_cache_pending[doc_id] = task
+        task.add_done_callback(lambda _: _context_cache_pending.pop(doc_id, None))
+    return await asyncio.shield(task)
+
+
+async def get_gemini_response(
+    document_text: str, question: str, doc_id: Optional[str] = None
+) -> str:
     if not question.strip():
         raise ValueError("Question must not be empty.")
+
+    normalized = _normalize_question(question)
+    question_vec: Optional[np.ndarray] = None
+    if doc_id:
+        cached = _cache_lookup_exact(doc_id, normalized)
+        if cached is not None:
+            return cached
+
+        question_vec = await asyncio.to_thread(_embed, normalized)
+        if question_vec is not None:
+            cached = _cache_lookup_similar(doc_id, question_vec)
+            if cached is not None:
+                return cached
     
-    # Rate limiting: ensure minimum interval between requests
-    current_time = time.time()
-    time_since_last_request = current_time - _last_request_time
-    if time_since_last_request < _min_request_interval:
-        wait_time = _min_request_interval - time_since_last_request
-        logger.info(f"Rate limiting: waiting {wait_time:.1f}s before next request")
-        await asyncio.sleep(wait_time)
-    
-    _last_request_time = time.time()
+    excerpts: Optional[str] = None
+    if doc_id and question_vec is not None and len(document_text) > MAX_DOCUMENT_CHARS:
+        await index_document(doc_id, document_text)
+        excerpts = _retrieve_chunks(doc_id, question_vec)
 
-    prompt = (
-        f"{SYSTEM_PROMPT}\n\n"
-        f"Document Text:\n{_truncate(document_text)}\n\n"
-        f"Question:\n{question.strip()}\n\n"
-        "Answer:"
-    )
+    question_block = f"Question:\n{question.strip()}\n\nAnswer:"
+    if excerpts is not None:
+        prompt = (
+            f"{SYSTEM_PROMPT}\n\n"
+            f"Document Excerpts:\n{excerpts}\n\n"
+            f"{question_block}"
+        )
+    else:
+        prompt = (
+            f"{SYSTEM_PROMPT}\n\n"
+            f"Document Text:\n{_truncate(document_text)}\n\n"
+            f"{question_block}"
+        )
+
+    # Retrieved excerpts change per question, so only whole-document
+    # prompts go through the per-doc context cache.
+    use_context_cache = doc_id is not None and excerpts is None
+
+    def _invoke(cache_name: Optional[str]):
+        if cache_name is None:
+            resp = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=prompt,
+            )
+            return (resp.text or "").strip()
 
-    def _invoke():
         resp = client.models.generate_content(
             model=MODEL_NAME,
-            contents=prompt,
+            contents=question_block,
+            config=types.GenerateContentConfig(cached_content=cache_name),
         )
         return (resp.text or "").strip()
 
@@ -73,9 +374,17 @@ async def get_gemini_response(document_text: str, question: str) -> str:
     base_delay = 3.0  # Increased initial delay
     
     for attempt in range(max_retries):
+        cache_name: Optional[str] = None
         try:
-            return await asyncio.to_thread(_invoke)
+            if use_context_cache:
+                cache_name = await _context_cache_name(doc_id, document_text)
+            async with _inflight:
+                await _acquire_token()
+                answer = await asyncio.to_thread(_invoke, cache_name)
         except Exception as e:
+            if cache_name is not None and _context_cache_ids.get(doc_id, (None,))[0] == cache_name:
+                # The cache may have been evicted server-side; rebuild on retry.
+                del _context_cache_ids[doc_id]
             error_msg = str(e)
             
             # Check for quota/rate limit errors
@@ -100,5 +409,9 @@ async def get_gemini_response(document_text: str, question: str) -> str:
                 continue
             else:
                 raise RuntimeError(f"Failed to get response from AI service: {error_msg}") from e
-    
+
+        if doc_id and answer:
+            _cache_store(doc_id, normalized, question_vec, answer)
+        return answer
+
     raise RuntimeError("Failed to get response from AI service after all retries")
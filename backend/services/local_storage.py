@@ -1,39 +1,70 @@
 """
 Local storage backend for development mode.
-Stores PDFs in ./tmp and metadata + messages in a JSON file.
+Stores PDFs in ./tmp and metadata + messages in a SQLite database.
 """
 
-import json
+import asyncio
 import logging
+import sqlite3
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Tuple
 from uuid import uuid4
 
+import aiosqlite
+import orjson
+
 logger = logging.getLogger(__name__)
 
 # Local filesystem paths
 BASE_DIR = Path(__file__).resolve().parent.parent
 TMP_DIR = BASE_DIR / "tmp"
-DB_FILE = BASE_DIR / "local_db.json"
+DB_FILE = BASE_DIR / "local_db.sqlite3"
+LEGACY_DB_FILE = BASE_DIR / "local_db.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    blob_name TEXT,
+    blob_url TEXT,
+    document_text TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_doc_user ON documents(user_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_msg_user_doc ON messages(user_id, doc_id);
+"""
 
-TMP_DIR.mkdir(parents=True, exist_ok=True)
-if not DB_FILE.exists():
-    DB_FILE.write_text(json.dumps({"documents": [], "messages": []}, indent=2))
+# Bumped via PRAGMA user_version once the legacy JSON DB has been imported.
+_SCHEMA_VERSION = 1
 
 
 def _utc_now() -> str:
     """Return a UTC timestamp in ISO-8601 format without microseconds."""
+    t = time.gmtime()
     return (
-        datetime.now(timezone.utc)
-        .replace(microsecond=0)
-        .isoformat()
-        .replace("+00:00", "Z")
+        f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+        f"T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
     )
 
 
 def _normalize_timestamp(value) -> str:
     """Coerce persisted timestamps into ISO-8601 strings for the client."""
+    # Already in the canonical "YYYY-MM-DDTHH:MM:SSZ" form written by _utc_now.
+    if isinstance(value, str) and len(value) == 20 and value.endswith("Z"):
+        return value
+
     if value in (None, ""):
         return _utc_now()
 
@@ -60,14 +91,75 @@ def _normalize_timestamp(value) -> str:
             return _utc_now()
 
 
-def _load_db() -> dict:
-    with DB_FILE.open("r") as f:
-        return json.load(f)
+def _import_legacy_json(conn: sqlite3.Connection) -> None:
+    """Copy documents and messages from the old local_db.json store."""
+    if not LEGACY_DB_FILE.exists():
+        return
 
+    try:
+        legacy = orjson.loads(LEGACY_DB_FILE.read_bytes())
+    except (OSError, ValueError):
+        logger.warning("Could not read legacy %s; skipping import.", LEGACY_DB_FILE.name)
+        return
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO documents "
+        "(id, user_id, file_name, blob_name, blob_url, document_text, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                doc["id"],
+                doc["user_id"],
+                doc.get("file_name", ""),
+                doc.get("blob_name"),
+                doc.get("blob_url"),
+                doc.get("document_text", ""),
+                _normalize_timestamp(doc.get("created_at")),
+            )
+            for doc in legacy.get("documents", [])
+        ],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO messages "
+        "(id, user_id, doc_id, role, content, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                entry.get("id") or str(uuid4()),
+                entry["user_id"],
+                entry["doc_id"],
+                entry["role"],
+                entry.get("content") or entry.get("message") or "",
+                _normalize_timestamp(entry.get("timestamp")),
+            )
+            for entry in legacy.get("messages", [])
+        ],
+    )
+    logger.info("Imported legacy %s into %s.", LEGACY_DB_FILE.name, DB_FILE.name)
 
-def _save_db(db: dict):
-    with DB_FILE.open("w") as f:
-        json.dump(db, f, indent=2)
+
+def _init_db() -> None:
+    """Create the schema, enable WAL and run the one-time JSON import."""
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version < _SCHEMA_VERSION:
+            _import_legacy_json(conn)
+            conn.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+TMP_DIR.mkdir(parents=True, exist_ok=True)
+_init_db()
+
+
+def _write_pdf(file_path: Path, file_bytes: bytes) -> None:
+    file_path.parent.mkdir(exist_ok=True)
+    file_path.write_bytes(file_bytes)
 
 
 async def save_pdf(
@@ -80,13 +172,10 @@ async def save_pdf(
     Stores the PDF on local disk and returns a fake blob URL.
     """
 
-    user_folder = TMP_DIR / user_id
-    user_folder.mkdir(exist_ok=True)
-
-    file_path = user_folder / file_name
+    file_path = TMP_DIR / user_id / file_name
     blob_name = f"{user_id}/{file_name}"
 
-    file_path.write_bytes(file_bytes)
+    await asyncio.to_thread(_write_pdf, file_path, file_bytes)
 
     fake_blob_url = f"file://{file_path}"
 
@@ -102,41 +191,34 @@ async def save_document(
     document_text: str,
 ):
     """
-    Save metadata + extracted text to local JSON DB.
+    Save metadata + extracted text to the local DB.
     """
 
-    db = _load_db()
-
-    created_at = _utc_now()
-
-    db["documents"].append(
-        {
-            "id": doc_id,
-            "user_id": user_id,
-            "file_name": file_name,
-            "blob_name": blob_name,
-            "blob_url": blob_url,
-            "document_text": document_text,
-            "created_at": created_at,
-            "type": "document",
-        }
-    )
-
-    _save_db(db)
+    async with aiosqlite.connect(DB_FILE) as db:
+        await db.execute(
+            "INSERT INTO documents "
+            "(id, user_id, file_name, blob_name, blob_url, document_text, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (doc_id, user_id, file_name, blob_name, blob_url, document_text, _utc_now()),
+        )
+        await db.commit()
 
 
 async def get_document_text(user_id: str, doc_id: str) -> str:
     """
-    Fetch stored extracted text from JSON DB.
+    Fetch stored extracted text from the local DB.
     """
 
-    db = _load_db()
+    async with aiosqlite.connect(DB_FILE) as db:
+        async with db.execute(
+            "SELECT document_text FROM documents WHERE id=? AND user_id=?",
+            (doc_id, user_id),
+        ) as cursor:
+            row = await cursor.fetchone()
 
-    for doc in db["documents"]:
-        if doc["user_id"] == user_id and doc["id"] == doc_id:
-            return doc["document_text"]
-
-    raise ValueError("Document not found.")
+    if row is None:
+        raise ValueError("Document not found.")
+    return row[0]
 
 
 async def save_message(user_id: str, doc_id: str, role: str, message: str):
@@ -144,21 +226,25 @@ async def save_message(user_id: str, doc_id: str, role: str, message: str):
     Store chat messages for history.
     """
 
-    db = _load_db()
+    await save_messages(user_id, doc_id, [(role, message)])
 
-    entry = {
-        "id": str(uuid4()),
-        "type": "message",
-        "user_id": user_id,
-        "doc_id": doc_id,
-        "role": role,
-        "content": message,
-        "timestamp": _utc_now(),
-    }
 
-    db["messages"].append(entry)
+async def save_messages(user_id: str, doc_id: str, messages: list[tuple[str, str]]):
+    """
+    Store several chat messages in a single transaction.
+    """
 
-    _save_db(db)
+    timestamp = _utc_now()
+    async with aiosqlite.connect(DB_FILE) as db:
+        await db.executemany(
+            "INSERT INTO messages (id, user_id, doc_id, role, content, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (str(uuid4()), user_id, doc_id, role, message, timestamp)
+                for role, message in messages
+            ],
+        )
+        await db.commit()
 
 
 async def get_history(user_id: str, doc_id: str | None = None):
@@ -166,75 +252,47 @@ async def get_history(user_id: str, doc_id: str | None = None):
     Load chat history for a user or a specific document.
     """
 
-    db = _load_db()
-    messages = db["messages"]
-
-    updated = False
+    async with aiosqlite.connect(DB_FILE) as db:
+        db.row_factory = aiosqlite.Row
 
-    if doc_id:
-        normalized = []
-        for entry in messages:
-            if entry.get("user_id") != user_id or entry.get("doc_id") != doc_id:
-                continue
+        if doc_id:
+            # rowid breaks ties between messages saved in the same second.
+            async with db.execute(
+                "SELECT id, user_id, doc_id, role, content, timestamp FROM messages "
+                "WHERE user_id=? AND doc_id=? ORDER BY timestamp, rowid",
+                (user_id, doc_id),
+            ) as cursor:
+                rows = await cursor.fetchall()
 
-            if "id" not in entry or not entry["id"]:
-                entry["id"] = str(uuid4())
-                updated = True
-
-            content = entry.get("content") or entry.get("message") or ""
-            if entry.get("content") != content:
-                entry["content"] = content
-                updated = True
-
-            timestamp = _normalize_timestamp(entry.get("timestamp"))
-            if entry.get("timestamp") != timestamp:
-                entry["timestamp"] = timestamp
-                updated = True
-
-            entry.setdefault("type", "message")
-
-            normalized.append(
+            return [
                 {
-                    "id": entry["id"],
-                    "type": entry["type"],
-                    "user_id": entry["user_id"],
-                    "doc_id": entry["doc_id"],
-                    "role": entry["role"],
-                    "content": entry["content"],
-                    "timestamp": entry["timestamp"],
+                    "id": row["id"],
+                    "type": "message",
+                    "user_id": row["user_id"],
+                    "doc_id": row["doc_id"],
+                    "role": row["role"],
+                    "content": row["content"],
+                    "timestamp": row["timestamp"],
                 }
-            )
+                for row in rows
+            ]
 
-        normalized.sort(key=lambda item: item["timestamp"])
-
-        if updated:
-            _save_db(db)
-
-        return normalized
-
-    documents = []
-    for doc in db["documents"]:
-        if doc.get("user_id") != user_id:
-            continue
-
-        created_at = _normalize_timestamp(doc.get("created_at"))
-        if doc.get("created_at") != created_at:
-            doc["created_at"] = created_at
-            updated = True
-
-        documents.append(
-            {
-                "id": doc["id"],
-                "type": doc.get("type", "document"),
-                "user_id": doc["user_id"],
-                "file_name": doc.get("file_name", ""),
-                "blob_name": doc.get("blob_name"),
-                "blob_url": doc.get("blob_url"),
-                "created_at": created_at,
-            }
-        )
-
-    if updated:
-        _save_db(db)
+        async with db.execute(
+            "SELECT id, user_id, file_name, blob_name, blob_url, created_at FROM documents "
+            "WHERE user_id=? ORDER BY rowid",
+            (user_id,),
+        ) as cursor:
+            rows = await cursor.fetchall()
 
-    return documents
+    return [
+        {
+            "id": row["id"],
+            "type": "document",
+            "user_id": row["user_id"],
+            "file_name": row["file_name"],
+            "blob_name": row["blob_name"],
+            "blob_url": row["blob_url"],
+            "created_at": row["created_at"],
+        }
+        for row in rows
+    ]
@@ -3,44 +3,76 @@ PDF extraction utilities using PyMuPDF (fitz).
 Extracts plain text from uploaded PDFs for use by Gemini.
 """
 
+import asyncio
+import logging
+import time
+
 import fitz  # PyMuPDF
-from fastapi import UploadFile, HTTPException
+from fastapi import HTTPException
 from typing import List
 
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+SLOW_PAGE_SECONDS = 5.0
+EXTRACTION_BUDGET_SECONDS = settings.pdf_extraction_budget_seconds
+
 
-async def extract_text_from_pdf(file: UploadFile) -> str:
+def _extract_sync(pdf_bytes: bytes) -> str:
     """
-    Extract plain text from a PDF uploaded via FastAPI.
+    Blocking PyMuPDF pass over every page; returns the stripped, joined text.
 
-    Steps:
-    1. Read PDF bytes from UploadFile
-    2. Reset pointer for re-use
-    3. Load PDF via PyMuPDF
-    4. Extract text from each page
-    5. Return combined text
+    PyMuPDF documents must not be shared across threads, so pages are read
+    sequentially here and the whole pass runs off the event loop instead.
+    A single get_text call cannot be interrupted, so the worst case is
+    bounded by a document-wide budget: once it is spent, the remaining
+    pages are replaced with a placeholder instead of being parsed.
     """
+    text_chunks: List[str] = []
+    started = time.monotonic()
 
-    # Read bytes
-    try:
-        pdf_bytes = await file.read()
-        file.file.seek(0)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Failed to read PDF upload.")
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        page_count = document.page_count
+        for index in range(page_count):
+            if time.monotonic() - started > EXTRACTION_BUDGET_SECONDS:
+                logger.warning(
+                    "PDF extraction budget of %.0fs exhausted; skipping pages %d-%d.",
+                    EXTRACTION_BUDGET_SECONDS,
+                    index + 1,
+                    page_count,
+                )
+                text_chunks.append(
+                    f"[Pages {index + 1}-{page_count} skipped: text extraction timed out]"
+                )
+                break
+
+            page_started = time.monotonic()
+            text = document.load_page(index).get_text("text", flags=fitz.TEXTFLAGS_TEXT).strip()
+            if text:
+                text_chunks.append(text)
+            elapsed = time.monotonic() - page_started
+            if elapsed > SLOW_PAGE_SECONDS:
+                logger.warning("Slow PDF page %d took %.1fs to extract.", index + 1, elapsed)
+
+    return "\n".join(text_chunks)
+
+
+async def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+    """
+    Extract plain text from the raw bytes of an uploaded PDF.
+
+    Steps:
+    1. Load PDF via PyMuPDF in a worker thread
+    2. Extract and strip text from each page, dropping empty pages
+    3. Return combined text
+    """
 
     try:
-        # Load PDF into memory
-        with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
-            text_chunks: List[str] = [
-                page.get_text("text") for page in document
-            ]
+        final_text = await asyncio.to_thread(_extract_sync, pdf_bytes)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
 
-    # Clean + merge text
-    final_text = "\n".join(
-        chunk.strip() for chunk in text_chunks if chunk.strip()
-    )
-
     if not final_text:
         raise HTTPException(status_code=400, detail="No extractable text found in the PDF.")
 
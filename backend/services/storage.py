@@ -2,58 +2,119 @@
 Storage service providing Azure Blob and local disk implementations.
 """
 
-import asyncio
 import logging
-import os
 from pathlib import Path
 from typing import Tuple
 
-from fastapi import UploadFile
-
-# Required env vars for Azure mode
-REQUIRED_AZURE_ENV_VARS = [
-    "AZURE_BLOB_CONNECTION_STRING",
-    "AZURE_BLOB_CONTAINER",
-    "COSMOS_URL",
-    "COSMOS_KEY",
-    "COSMOS_DB",
-    "COSMOS_CONTAINER",
-    "ALLOWED_ORIGIN",
-]
+from ..settings import settings
 
 # Determine whether to run in LOCAL MODE
-USE_LOCAL_MODE = any(not os.getenv(name) for name in REQUIRED_AZURE_ENV_VARS)
+USE_LOCAL_MODE = settings.use_local_mode
 logger = logging.getLogger(__name__)
 
 if USE_LOCAL_MODE:
     from . import local_storage
 else:
-    from azure.core.exceptions import ResourceExistsError
-    from azure.storage.blob import BlobServiceClient, ContentSettings
+    from aiohttp import ClientSession, TCPConnector
+    from azure.core.exceptions import HttpResponseError, ResourceExistsError
+    from azure.core.pipeline.transport import AioHttpTransport
+    from azure.storage.blob import ContentSettings
+    from azure.storage.blob.aio import BlobServiceClient, ContainerClient
+
+    AZURE_CONNECTION_STRING = settings.azure_blob_connection_string or ""
+    AZURE_CONTAINER = settings.azure_blob_container or ""
+
+    # Uploads above BLOB_MAX_SINGLE_PUT_SIZE are split into blocks of
+    # BLOB_MAX_BLOCK_SIZE and sent BLOB_UPLOAD_CONCURRENCY at a time.
+    BLOB_UPLOAD_CONCURRENCY = settings.azure_blob_upload_concurrency
+    BLOB_MAX_SINGLE_PUT_SIZE = settings.azure_blob_max_single_put_size
+    BLOB_MAX_BLOCK_SIZE = settings.azure_blob_max_block_size
+
+    # Shared HTTP pool; never smaller than one upload's block concurrency so
+    # parallel block PUTs keep their connections alive instead of churning.
+    BLOB_POOL_SIZE = max(settings.azure_blob_pool_size, BLOB_UPLOAD_CONCURRENCY)
+
+    _http_session: ClientSession | None = None
+    _blob_service_client: BlobServiceClient | None = None
+    _container_client: ContainerClient | None = None
+    _container_ready = False
 
-    AZURE_CONNECTION_STRING = os.getenv("AZURE_BLOB_CONNECTION_STRING", "")
-    AZURE_CONTAINER = os.getenv("AZURE_BLOB_CONTAINER", "")
 
-    _blob_service_client: BlobServiceClient | None = None
+async def init_blob_client():
+    """
+    Create the shared async BlobServiceClient. Called once at app startup.
+
+    No network calls are made here; the container is ensured on first upload.
+    """
+    global _http_session, _blob_service_client, _container_client
+    if USE_LOCAL_MODE:
+        return None
+    if _blob_service_client:
+        return _blob_service_client
+
+    session = ClientSession(connector=TCPConnector(limit=BLOB_POOL_SIZE))
+    try:
+        transport = AioHttpTransport(
+            session=session,
+            session_owner=False,
+            connection_timeout=30,
+            read_timeout=60,
+        )
+        service_client = BlobServiceClient.from_connection_string(
+            AZURE_CONNECTION_STRING,
+            transport=transport,
+            max_single_put_size=BLOB_MAX_SINGLE_PUT_SIZE,
+            max_block_size=BLOB_MAX_BLOCK_SIZE,
+        )
+    except Exception:
+        await session.close()
+        raise
+
+    _http_session = session
+    _blob_service_client = service_client
+    _container_client = service_client.get_container_client(AZURE_CONTAINER)
+    return _blob_service_client
+
+
+async def close_blob_client() -> None:
+    """
+    Release the shared blob client and its HTTP pool. Called at app shutdown.
+    """
+    global _http_session, _blob_service_client, _container_client, _container_ready
+    if USE_LOCAL_MODE:
+        return
+
+    if _blob_service_client:
+        await _blob_service_client.close()
+    if _http_session:
+        await _http_session.close()
+
+    _http_session = None
+    _blob_service_client = None
     _container_client = None
+    _container_ready = False
 
-    def _get_container_client():
-        """Lazy-load blob container client."""
-        global _blob_service_client, _container_client
-        if _container_client:
-            return _container_client
 
-        _blob_service_client = BlobServiceClient.from_connection_string(
-            AZURE_CONNECTION_STRING
-        )
-        _container_client = _blob_service_client.get_container_client(AZURE_CONTAINER)
+async def _get_container_client():
+    """Return the shared container client, creating the container on first use."""
+    global _container_ready
+    if _container_client is None:
+        await init_blob_client()
 
+    if not _container_ready:
         try:
-            _container_client.create_container()
+            await _container_client.create_container()
         except ResourceExistsError:
             pass
+        except HttpResponseError as exc:
+            # A container-scoped SAS may not allow creating containers; the
+            # container is expected to exist already in that case.
+            if exc.status_code != 403:
+                raise
+            logger.info("No permission to create blob container; assuming it exists.")
+        _container_ready = True
 
-        return _container_client
+    return _container_client
 
 
 def _sanitize_filename(filename: str, fallback: str) -> str:
@@ -64,7 +125,13 @@ def _sanitize_filename(filename: str, fallback: str) -> str:
     return name or fallback
 
 
-async def upload_to_blob(file: UploadFile, doc_id: str, user_id: str) -> Tuple[str, str, str]:
+async def upload_to_blob(
+    pdf_bytes: bytes,
+    file_name: str,
+    content_type: str | None,
+    doc_id: str,
+    user_id: str,
+) -> Tuple[str, str, str]:
     """
     Uploads PDF to Azure blob OR local filesystem depending on mode.
 
@@ -72,33 +139,27 @@ async def upload_to_blob(file: UploadFile, doc_id: str, user_id: str) -> Tuple[s
         blob_url, stored_file_name, blob_name
     """
 
-    safe_file_name = _sanitize_filename(file.filename or "", f"{doc_id}.pdf")
-
-    # Read bytes
-    file_bytes = await file.read()
-    file.file.seek(0)
+    safe_file_name = _sanitize_filename(file_name, f"{doc_id}.pdf")
 
     # LOCAL MODE
     if USE_LOCAL_MODE:
         return await local_storage.save_pdf(
-            file_bytes, safe_file_name, doc_id, user_id
+            pdf_bytes, safe_file_name, doc_id, user_id
         )
 
     # CLOUD MODE - Azure Blob Storage
     blob_name = f"{user_id}/{doc_id}/{safe_file_name}"
 
-    def _upload() -> str:
-        container_client = _get_container_client()
-        blob_client = container_client.get_blob_client(blob_name)
-
-        blob_client.upload_blob(
-            file_bytes,
-            overwrite=True,
-            content_settings=ContentSettings(
-                content_type=file.content_type or "application/pdf"
-            ),
-        )
-        return blob_client.url
-
-    blob_url = await asyncio.to_thread(_upload)
-    return blob_url, safe_file_name, blob_name
+    container_client = await _get_container_client()
+    blob_client = container_client.get_blob_client(blob_name)
+
+    await blob_client.upload_blob(
+        pdf_bytes,
+        overwrite=True,
+        length=len(pdf_bytes),
+        max_concurrency=BLOB_UPLOAD_CONCURRENCY,
+        content_settings=ContentSettings(
+            content_type=content_type or "application/pdf"
+        ),
+    )
+    return blob_client.url, safe_file_name, blob_name
@@ -0,0 +1,65 @@
+"""
+Application settings for Azure PDF Chat.
+Read once from the environment (and backend/.env) at import time.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+ENV_FILE = Path(__file__).resolve().parent / ".env"
+
+# All of these must be set to run in Azure mode (Blob + Cosmos)
+REQUIRED_AZURE_ENV_VARS = [
+    "AZURE_BLOB_CONNECTION_STRING",
+    "AZURE_BLOB_CONTAINER",
+    "COSMOS_URL",
+    "COSMOS_KEY",
+    "COSMOS_DB",
+    "COSMOS_CONTAINER",
+    "ALLOWED_ORIGIN",
+]
+
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=ENV_FILE, extra="ignore")
+
+    # Gemini
+    gemini_api_key: Optional[str] = None
+    gemini_model: str = "gemini-2.0-flash"
+    gemini_embedding_model: str = "text-embedding-004"
+    gemini_max_rpm: int = 15  # Gemini free tier
+    gemini_max_concurrent: int = 4
+    gemini_context_cache_min_tokens: int = 1024
+
+    # Azure Blob Storage
+    azure_blob_connection_string: Optional[str] = None
+    azure_blob_container: Optional[str] = None
+    azure_blob_pool_size: int = 32
+    azure_blob_upload_concurrency: int = 8
+    azure_blob_max_single_put_size: int = 8 * 1024 * 1024
+    azure_blob_max_block_size: int = 4 * 1024 * 1024
+
+    # Azure Cosmos DB
+    cosmos_url: Optional[str] = None
+    cosmos_key: Optional[str] = None
+    cosmos_db: Optional[str] = None
+    cosmos_container: Optional[str] = None
+
+    # CORS
+    allowed_origin: Optional[str] = None
+
+    # PDF extraction
+    pdf_extraction_budget_seconds: float = 120.0
+
+    @property
+    def missing_azure_env(self) -> list[str]:
+        return [name for name in REQUIRED_AZURE_ENV_VARS if not getattr(self, name.lower())]
+
+    @property
+    def use_local_mode(self) -> bool:
+        return bool(self.missing_azure_env)
+
+
+settings = Settings()
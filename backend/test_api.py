@@ -1,41 +1,522 @@
-"""Quick test script to check Gemini API status."""
+"""Quick test script to check Gemini API status.
+
+Library callers inside an event loop should ``await test_api()`` directly,
+which keeps the shared client's connection pool alive between calls. Sync
+callers should use ``run_sync()``: it reuses one event loop, whereas each
+``asyncio.run`` builds and tears down its own.
+"""
+
+from __future__ import annotations
 
 import os
+import argparse
 import asyncio
-from dotenv import load_dotenv
-from google import genai
-
-load_dotenv()
-
-async def test_api():
-    api_key = os.getenv("GEMINI_API_KEY")
-    model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-    
-    print(f"Testing API Key: {api_key[:10]}...")
-    print(f"Using Model: {model_name}")
-    
-    client = genai.Client(api_key=api_key)
-    
+import hashlib
+import importlib.util
+import json
+import random
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from google import genai
+
+T = TypeVar("T")
+
+ENV_FILE = Path(__file__).resolve().parent / ".env"
+DEFAULT_MODEL = "gemini-1.5-flash"
+
+# Reused HTTP settings for the probe client (timeout is in milliseconds).
+# The pool belongs to the probe client alone and is kept small, so a
+# harness that imports test_api never has probes crowding its own traffic.
+_HTTP_TIMEOUT_MS = 30_000
+_HTTP_MAX_CONNECTIONS = 4
+_HTTP_MAX_KEEPALIVE = 4
+# HTTP/2 lets concurrent probes multiplex over one TLS connection. It needs
+# ``h2``, which requirements.txt pulls in via httpx[http2]; without it the
+# probes fall back to HTTP/1.1.
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Bounded exponential backoff with jitter for transient failures.
+_MAX_ATTEMPTS = 5
+_BACKOFF_BASE = 1.0
+_BACKOFF_CAP = 30.0
+# A server-supplied retry delay (Retry-After / RetryInfo) is honored up to this.
+_RETRY_AFTER_CAP = 60.0
+
+# Fail fast instead of hanging CI when Gemini stalls; timeouts are retried.
+_CALL_TIMEOUT = 15.0  # seconds
+
+# File-backed circuit breaker: after _BREAKER_THRESHOLD consecutive failures
+# (each within _BREAKER_WINDOW of the previous one) skip probing for
+# _BREAKER_COOLDOWN seconds, then let a single half-open probe through.
+CACHE_DIR = Path.home() / ".cache" / "ai-ka"
+_BREAKER_FILE = CACHE_DIR / "test_api_cb.json"
+_BREAKER_THRESHOLD = 3
+_BREAKER_WINDOW = 300.0  # seconds
+_BREAKER_COOLDOWN = 60.0  # seconds
+
+# A run that fully succeeded within _SUCCESS_TTL for the same key and
+# models is reported from disk without another network round trip.
+_SUCCESS_FILE = CACHE_DIR / "test_api_ok.json"
+_SUCCESS_TTL = 60.0  # seconds
+
+# Bulkhead: at most this many Gemini calls from test_api are in flight at
+# once, however many models or concurrent test_api() callers there are.
+_PROBE_BULKHEAD = 2
+
+TEST_PROMPT = "Say 'API is working!' in one short sentence."
+
+# Multi-line status blocks are formatted from these templates and emitted
+# with a single write, so CI logs get one syscall per block.
+_HEADER_TEMPLATE = "Testing API Key fp: {key_fp}\nUsing Model(s): {models}\n"
+_RETRY_TEMPLATE = "⏳ Transient error, retrying in {delay:.1f}s (attempt {attempt}/{attempts})...\n"
+_QUOTA_HINT_TEMPLATE = (
+    "\n⚠️  QUOTA ISSUE DETECTED\n"
+    "Solutions:\n"
+    "1. Wait {wait} and try again (free tier rate limit)\n"
+    "2. Check your quota at: https://aistudio.google.com/apikey\n"
+    "3. Try a different API key\n"
+    "4. Upgrade to paid tier for higher limits\n"
+)
+_AUTH_HINT = (
+    "\n⚠️  AUTHENTICATION ISSUE DETECTED\n"
+    "Check that GEMINI_API_KEY is correct and enabled at: https://aistudio.google.com/apikey\n"
+)
+
+
+@lru_cache(maxsize=1)
+def _deps() -> SimpleNamespace:
+    """Import the SDK stack on first use.
+
+    google.genai pulls in httpx, pydantic and protobuf; deferring it keeps
+    --help and the local short-circuit checks from paying that import.
+    """
+    import httpx
+    from google import genai
+    from google.genai import errors, types
+
+    return SimpleNamespace(httpx=httpx, genai=genai, errors=errors, types=types)
+
+
+@lru_cache(maxsize=1)
+def _test_config():
+    # Tiny deterministic reply: the probe only needs proof of life, not prose.
+    # Models that think may use the budget up and stream an empty chunk; that
+    # still shows the request was accepted.
+    return _deps().types.GenerateContentConfig(
+        max_output_tokens=8,
+        temperature=0.0,
+        candidate_count=1,
+    )
+
+
+def _emit(block: str) -> None:
+    sys.stdout.write(block)
+    sys.stdout.flush()
+
+
+def _env_mtime() -> float:
+    try:
+        return ENV_FILE.stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+@lru_cache(maxsize=1)
+def _load_env(mtime: float) -> dict[str, str]:
+    """Parse .env once per file version; real environment variables win.
+
+    ``mtime`` is only the cache key: editing .env invalidates the entry.
+    """
+    from dotenv import dotenv_values
+
+    values = {key: value for key, value in dotenv_values(ENV_FILE).items() if value is not None}
+    for key in ("GEMINI_API_KEY", "GEMINI_MODEL"):
+        if key in os.environ:
+            values[key] = os.environ[key]
+    return values
+
+
+def _config() -> tuple[Optional[str], str]:
+    """Return (api_key, model_name) from the cached environment."""
+    env = _load_env(_env_mtime())
+    return env.get("GEMINI_API_KEY"), env.get("GEMINI_MODEL", DEFAULT_MODEL)
+
+
+_clients: dict[tuple[str, asyncio.AbstractEventLoop], genai.Client] = {}
+
+
+def _get_client(api_key: str) -> genai.Client:
+    """The genai client for this key on the running loop.
+
+    Calls on the same loop (run_sync, or awaiting test_api repeatedly) share
+    its connection pool. The httpx pool is bound to the loop that opened
+    its connections, so every new loop gets a fresh client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get((api_key, loop))
+    if client is None:
+        for stale in [key for key in _clients if key[1].is_closed()]:
+            del _clients[stale]
+        client = _clients[(api_key, loop)] = _build_client(api_key)
+    return client
+
+
+def _build_client(api_key: str) -> genai.Client:
+    deps = _deps()
+    limits = deps.httpx.Limits(
+        max_connections=_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=_HTTP_MAX_KEEPALIVE,
+    )
+    return deps.genai.Client(
+        api_key=api_key,
+        http_options=deps.types.HttpOptions(
+            timeout=_HTTP_TIMEOUT_MS,
+            client_args={"limits": limits},
+            # An explicit httpx client also keeps the SDK off its aiohttp path,
+            # so the pool limits above apply to the async probes.
+            httpx_async_client=deps.httpx.AsyncClient(
+                http2=_HTTP2,
+                limits=limits,
+                timeout=_HTTP_TIMEOUT_MS / 1000,
+            ),
+        ),
+    )
+
+
+def _read_state(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(path: Path, state: dict) -> None:
+    """Write atomically so concurrent runs never see a half-written file."""
     try:
-        print("\nSending test request...")
-        resp = client.models.generate_content(
-            model=model_name,
-            contents="Say 'API is working!' in one short sentence."
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _breaker_state(api_key: str) -> dict:
+    """Breaker state for this key; state left behind by another key is ignored."""
+    state = _read_state(_BREAKER_FILE)
+    return state if state.get("key_hash") == _key_fp(api_key) else {}
+
+
+def _breaker_is_open(api_key: str) -> bool:
+    state = _breaker_state(api_key)
+    if state.get("failures", 0) < _BREAKER_THRESHOLD:
+        return False
+    return time.time() - state.get("opened_at", 0.0) < _BREAKER_COOLDOWN
+
+
+def _breaker_record(api_key: str, success: bool) -> None:
+    key_hash = _key_fp(api_key)
+    if success:
+        _write_state(
+            _BREAKER_FILE,
+            {"key_hash": key_hash, "failures": 0, "opened_at": 0.0, "last_failure_at": 0.0},
         )
-        print(f"✅ SUCCESS: {resp.text}")
-        return True
+        return
+
+    now = time.time()
+    state = _breaker_state(api_key)
+    failures = state.get("failures", 0)
+    if now - state.get("last_failure_at", 0.0) > _BREAKER_WINDOW:
+        failures = 0
+    failures += 1
+
+    opened_at = now if failures >= _BREAKER_THRESHOLD else 0.0
+    _write_state(
+        _BREAKER_FILE,
+        {"key_hash": key_hash, "failures": failures, "opened_at": opened_at, "last_failure_at": now},
+    )
+
+
+_probe_sems: dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+
+def _probe_sem() -> asyncio.Semaphore:
+    """The bulkhead semaphore for the running loop (a semaphore is loop-bound)."""
+    loop = asyncio.get_running_loop()
+    sem = _probe_sems.get(loop)
+    if sem is None:
+        for stale in [other for other in _probe_sems if other.is_closed()]:
+            del _probe_sems[stale]
+        sem = _probe_sems[loop] = asyncio.Semaphore(_PROBE_BULKHEAD)
+    return sem
+
+
+def _key_looks_valid(api_key: Optional[str]) -> bool:
+    """Cheap local shape check for Google API keys ("AIza" + 35 chars)."""
+    return bool(api_key) and api_key.startswith("AIza") and len(api_key) >= 4 + 35
+
+
+async def _check_key(client: genai.Client) -> Optional[Exception]:
+    """List models (no tokens generated) to validate the key. Returns the error, if any.
+
+    Transient failures get the same backoff as the generate probes.
+    """
+    try:
+        await _with_retries(lambda: client.aio.models.list(config={"page_size": 1}))
     except Exception as e:
-        error_msg = str(e)
-        print(f"❌ ERROR: {error_msg}")
-        
-        if "429" in error_msg or "quota" in error_msg.lower():
-            print("\n⚠️  QUOTA ISSUE DETECTED")
-            print("Solutions:")
-            print("1. Wait 60 seconds and try again (free tier rate limit)")
-            print("2. Check your quota at: https://aistudio.google.com/apikey")
-            print("3. Try a different API key")
-            print("4. Upgrade to paid tier for higher limits")
+        return e
+    return None
+
+
+@lru_cache(maxsize=4)
+def _key_fp(api_key: str) -> str:
+    """Short stable fingerprint of the key: greppable across runs, never the key itself."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+def _success_is_cached(api_key: str, models: list[str]) -> bool:
+    state = _read_state(_SUCCESS_FILE)
+    return (
+        time.time() - state.get("ts", 0.0) < _SUCCESS_TTL
+        and state.get("key_hash") == _key_fp(api_key)
+        and set(models) <= set(state.get("models", []))
+    )
+
+
+def _record_success(api_key: str, models: list[str]) -> None:
+    _write_state(
+        _SUCCESS_FILE,
+        {"ts": time.time(), "key_hash": _key_fp(api_key), "models": sorted(models)},
+    )
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from RetryInfo or Retry-After."""
+    if not isinstance(exc, _deps().errors.APIError):
+        return None
+
+    details = exc.details.get("error", exc.details) if isinstance(exc.details, dict) else {}
+    for detail in details.get("details") or []:
+        if isinstance(detail, dict) and str(detail.get("@type", "")).endswith("RetryInfo"):
+            try:
+                # google.protobuf.Duration in JSON form, e.g. "31s" or "1.5s".
+                return float(str(detail.get("retryDelay", "")).rstrip("s"))
+            except ValueError:
+                pass
+
+    headers = getattr(exc.response, "headers", None)
+    if headers is not None:
+        try:
+            return float(headers.get("retry-after", ""))
+        except ValueError:
+            pass
+    return None
+
+
+def _server_delay(exc: Exception) -> Optional[float]:
+    """The server's requested delay, clamped to [0, _RETRY_AFTER_CAP]."""
+    delay = _retry_after(exc)
+    if delay is None:
+        return None
+    return min(_RETRY_AFTER_CAP, max(0.0, delay))
+
+
+def _backoff_delay(attempt: int, exc: Optional[Exception] = None) -> float:
+    server_delay = _server_delay(exc) if exc is not None else None
+    if server_delay is not None:
+        return server_delay
+    return min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth
+    retrying; auth failures and bad requests are not."""
+    deps = _deps()
+    if isinstance(exc, deps.errors.APIError):
+        return exc.code == 429 or exc.code >= 500
+    return isinstance(exc, (asyncio.TimeoutError, deps.httpx.TransportError))
+
+
+def _describe(exc: Exception) -> str:
+    if isinstance(exc, asyncio.TimeoutError):
+        return f"No response within {_CALL_TIMEOUT:.0f}s"
+    return str(exc)
+
+
+async def _first_chunk(client: genai.Client, model_name: str):
+    """Stream the reply and stop at the first chunk: enough to prove the API works."""
+    stream = await client.aio.models.generate_content_stream(
+        model=model_name,
+        contents=TEST_PROMPT,
+        config=_test_config(),
+    )
+    try:
+        async for chunk in stream:
+            return chunk
+    finally:
+        await stream.aclose()
+    raise RuntimeError("Empty response stream")
+
+
+async def _with_retries(make_call: Callable[[], Awaitable[T]]) -> T:
+    """Await a fresh ``make_call()`` per attempt, backing off on transient errors.
+
+    Each attempt holds a bulkhead slot only while it is on the wire, never
+    during the backoff sleep, so a rate-limited model cannot block others.
+    """
+    for attempt in range(_MAX_ATTEMPTS):
+        try:
+            async with _probe_sem():
+                return await asyncio.wait_for(make_call(), timeout=_CALL_TIMEOUT)
+        except Exception as e:
+            if attempt == _MAX_ATTEMPTS - 1 or not _is_retryable(e):
+                raise
+            delay = _backoff_delay(attempt, e)
+            _emit(_RETRY_TEMPLATE.format(delay=delay, attempt=attempt + 1, attempts=_MAX_ATTEMPTS))
+            await asyncio.sleep(delay)
+
+
+def _print_hints(failures: list[Exception]) -> None:
+    """Print remediation hints keyed on the API status codes of the failures."""
+    api_error = _deps().errors.APIError
+    codes = {error.code for error in failures if isinstance(error, api_error)}
+
+    if 429 in codes:
+        delays = [delay for delay in map(_server_delay, failures) if delay is not None]
+        # Same cap and precision as the retry notice, so "0.2s" is not shown as 0.
+        wait = f"{max(delays):.1f} seconds" if delays else "60 seconds"
+        _emit(_QUOTA_HINT_TEMPLATE.format(wait=wait))
+    elif codes & {401, 403}:
+        _emit(_AUTH_HINT)
+
+
+async def probe(client: genai.Client, model_name: str) -> Optional[Exception]:
+    """Send the test prompt to one model. Returns None on success, else the error."""
+    try:
+        resp = await _with_retries(lambda: _first_chunk(client, model_name))
+    except Exception as e:
+        print(f"❌ ERROR [{model_name}]: {_describe(e)}")
+        return e
+
+    print(f"✅ SUCCESS [{model_name}]: {(resp.text or '').strip()}")
+    return None
+
+
+def _short_circuit(api_key: Optional[str], models: list[str]) -> Optional[bool]:
+    """Answer from local state alone when possible; None means a live probe is needed.
+
+    Synchronous on purpose: the CLI and run_sync() call it before creating
+    an event loop, so these paths never pay for loop setup.
+    """
+    if not _key_looks_valid(api_key):
+        print("❌ ERROR: GEMINI_API_KEY is missing or malformed (expected an 'AIza...' key).")
+        return False
+
+    if _success_is_cached(api_key, models):
+        print(f"✅ cached OK: {', '.join(models)} verified in the last {_SUCCESS_TTL:.0f}s")
+        return True
+
+    if _breaker_is_open(api_key):
+        print("⛔ Circuit open after repeated failures; skipping probe.")
+        return False
+
+    return None
+
+
+def _prepare(models: Optional[list[str]]) -> tuple[Optional[bool], Optional[str], list[str]]:
+    """Resolve (verdict, api_key, models); a non-None verdict needs no probe."""
+    api_key, default_model = _config()
+    models = models or [default_model]
+    return _short_circuit(api_key, models), api_key, models
+
+
+async def _probe_all(api_key: str, models: list[str]) -> bool:
+    _emit(_HEADER_TEMPLATE.format(key_fp=_key_fp(api_key), models=", ".join(models)))
+
+    client = _get_client(api_key)
+
+    # Validate the key with a token-free call first; this also opens the
+    # connection that the generate probes below reuse.
+    key_error = await _check_key(client)
+    if key_error is not None:
+        print(f"❌ ERROR: API key check failed: {_describe(key_error)}")
+        _print_hints([key_error])
+        _breaker_record(api_key, False)
         return False
 
+    print("\nSending test request...")
+    results = await asyncio.gather(*(probe(client, model) for model in models))
+    failures = [error for error in results if error is not None]
+
+    # Any success means the key and service are fine. Only a total outage
+    # with transient errors counts against the breaker: a mistyped model
+    # (404) or a bad request is not an outage and must not block other models.
+    if len(failures) < len(models):
+        _breaker_record(api_key, True)
+    elif any(_is_retryable(error) for error in failures):
+        _breaker_record(api_key, False)
+
+    _print_hints(failures)
+
+    if not failures:
+        _record_success(api_key, models)
+    return not failures
+
+
+async def test_api(models: Optional[list[str]] = None) -> bool:
+    """Probe each model (default: GEMINI_MODEL) concurrently over one client."""
+    verdict, api_key, models = _prepare(models)
+    if verdict is not None:
+        return verdict
+    return await _probe_all(api_key, models)
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def run_sync(models: Optional[list[str]] = None) -> bool:
+    """Run test_api on a persistent event loop shared by repeated calls."""
+    global _loop
+    verdict, api_key, models = _prepare(models)
+    if verdict is not None:
+        return verdict
+
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(_probe_all(api_key, models))
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "models",
+        nargs="*",
+        help="Model names to probe concurrently (default: GEMINI_MODEL from .env).",
+    )
+    return parser.parse_args()
+
+
+def _run(coro: Awaitable[T]) -> T:
+    """Run ``coro`` on uvloop's libuv event loop when installed (not on Windows)."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(coro)
+    # uvloop.run() replaces install()/event loop policies, deprecated upstream.
+    return uvloop.run(coro)
+
+
 if __name__ == "__main__":
-    asyncio.run(test_api())
+    args = _parse_args()
+
+    # Local short-circuits exit before any event loop is built.
+    ok, api_key, models = _prepare(args.models or None)
+    if ok is None:
+        ok = _run(_probe_all(api_key, models))
+    sys.exit(0 if ok else 1)